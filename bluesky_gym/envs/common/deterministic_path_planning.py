@@ -23,10 +23,13 @@ Uses tools from "mytools.py" and "windfield.py".
 
 """
 
-import matplotlib.pyplot as plt
+import heapq
+import math
+import operator
+from itertools import count
 import numpy as np
-from bluesky_gym.envs.common.tools_deterministic_path_planning import Pos, LatLon2XY, XY2LatLon, Obs, parse,\
-Route,wyptannotate,callWinds,intersectionpt,specifywindfield
+from bluesky_gym.envs.common.tools_deterministic_path_planning import Pos, LatLon2XY, XY2LatLon, defineobstacles, parse,\
+Route,wyptannotate,callWinds,intersectionpts,specifywindfield,bboxquery
 
 def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
     #################################################################
@@ -98,20 +101,15 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
     xmin = min(orig[1],dest[1])
     xmax = max(orig[1],dest[1])
     
-    obstacle_list_xy = []
-    for polygon in inputObs:
-        vertices_list_xy = []
-        for lat, lon in polygon:
-            x, y = LatLon2XY(lat, lon)
-            vertices_list_xy.append((x, y))
-        obstacle_list_xy.append(vertices_list_xy)
+    # convert obstacles to instances of the obstacle class, this is cached as
+    # the same obstacles are passed in for every aircraft (hashable input needed)
+    obstacles, obsbboxes = defineobstacles(tuple(tuple(map(tuple, polygon)) for polygon in inputObs))
 
     # create obstacle dictionary (key is obstacle index)
-    obsDic_xy = {i: obstacle_list_xy[i] for i in range(len(obstacle_list_xy))}
-    
-    # define as instance of the obstacle class
-    for i in range(len(obsDic_xy)):
-        obsDic_xy[i] = Obs(obsDic_xy[i])
+    obsDic_xy = dict(enumerate(obstacles))
+
+    # results of shortcut checks in backward cleanup, shared by all routes of this call
+    blockmemo = {}
 
     # Add edge around it of 1%
     margin = 0.01
@@ -131,6 +129,11 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
 
     #################################################################
 
+    # active routes are kept in a min-heap of (deviation, counter, route),
+    # the counter breaks ties between equal deviations in order of creation
+    Route.active = []
+    counter = count()
+
     # generate direct route using origin and destination info
     distance, heading, wypts = parse(origin,destination)
     nominaltime = distance/TAS
@@ -156,8 +159,7 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
 
     directrt.clean(obsDic_xy)
 
-    Route.active[-1] = directrt
-    # Route.active.append(directrt)
+    heapq.heappush(Route.active, (directrt.deviation, next(counter), directrt))
 
     #################################################################
 
@@ -167,11 +169,12 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
 
     # create plot
     if plt_enable:
+        # only import matplotlib when plotting, importing it is slow
+        import matplotlib.pyplot as plt
         fig = plt.figure()
 
         # define waypoints along direct route, annotate and plot
-        (xwpts,ywpts) = list(zip(*directrt.waypoints))               # unzip x and y waypoint coordinates
-        wyptannotate(xwpts,ywpts)
+        wyptannotate(directrt.xs,directrt.ys)
         #plt.plot(xwpts,ywpts,'--')
 
     if plt_enable:
@@ -199,12 +202,21 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
 
     incflag = 0
     incumbent = float('inf')
+    first_pop = 1
+
+    # route cost to compare with the incumbent, selected once for the optimization priority
+    if optimizationpriority == 0:
+        routecost = operator.attrgetter('distance')
+    else:
+        routecost = operator.attrgetter('time')
 
     while len(Route.active): 
         if console_logging_flag:
             print('length of active: ',len(Route.active))
 
-        if len(Route.active) > 1000:
+        # give up once about 500 candidate routes are pending (routes used to
+        # be queued twice, so the old limit of 1000 entries meant the same)
+        if len(Route.active) > 500:
             if plt_enable:
                 plt.show()
             Route.active = []
@@ -212,24 +224,18 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
         
         directrtplted = 0
         
-        ## logic for setting parent to least deviation OR only option from active list
-        if len(Route.active) == 1:
-            parent = Route.active.pop()
-            # if there is only 1 active route and no incumbent,
-            # assume it's direct rt and plot for reference        
-            if incflag == 0 and pltdirectrt:
-                parentX,parentY = list(zip(*parent.waypoints))
+        ## set parent to route with least deviation from active list
+        _, _, parent = heapq.heappop(Route.active)
+        # the first route popped is the direct route, plot it for reference
+        if first_pop:
+            if pltdirectrt:
+                parentX,parentY = parent.xs,parent.ys
                 plt.plot(parentX,parentY,'--') 
                 directrtplted = 1
-        else:
-            deviationmin = []
-            for i in range(len(Route.active)):
-                deviationmin.append(Route.active[i].deviation)
-            topop = deviationmin.index(min(deviationmin))
-            parent = Route.active.pop(topop)
+            first_pop = 0
         ##
         if plttrialsols and not directrtplted:    
-            parentX,parentY = list(zip(*parent.waypoints))
+            parentX,parentY = parent.xs,parent.ys
             plt.plot(parentX,parentY,'--')
 
             # if debugging_printing_flag:
@@ -238,86 +244,72 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
 
 
         # if there is an incumbent... check if route length (or time) is greater than incumbent length (or time)
-        if incflag==1:
-            if optimizationpriority == 0:
-                if parent.distance>=incumbent.distance:
-                    # "fathom route" because it can only get longer with deviations
-                    if console_logging_flag:
-                        print('> incumbent')
-        #                print 'parent distance [NM]:', parent.distance
-                        print('')
-                    continue
-            elif optimizationpriority == 1:
-                if parent.time>=incumbent.time:
-                    # "fathom route" because it can only get longer with deviations
-                    if console_logging_flag:
-                        print('> incumbent')
-        #                print 'parent time [hr]:', parent.time
-                        print('')
-    #                parentX,parentY = zip(*parent.waypoints)
-    #                plt.plot(parentX,parentY,'-.')   
-                    continue
+        if incflag==1 and routecost(parent)>=routecost(incumbent):
+            # "fathom route" because it can only get longer with deviations
+            if console_logging_flag:
+                print('> incumbent')
+                print('')
+            continue
 
     #    Parentx,Parenty = zip(*parent.waypoints)
     #    plt.plot(Parentx,Parenty,'--')     
 
 
         # check if parent route intersects any obstacles
-        allintersections =  []                          # create empty list to hold lists for each obstacle       
-        for obstacle in range(len(obsDic_xy)):             # loop through all obstacles
+        allintersections = [[] for _ in range(len(obsDic_xy))]    # create empty list to hold lists for each obstacle
+        for obstacle in bboxquery(parent.bbox,obsbboxes):   # loop through obstacles overlapping the route bounding box
             # tabulate intersections between route segments and obstacle segments
-            allintersections.append(obsDic_xy[obstacle].intersectroute(parent))
+            allintersections[obstacle] = obsDic_xy[obstacle].intersectroute(parent)
 
         if debugging_printing_flag:
             print(f'allintersections with obstacle ', allintersections)
             for obstacle in range(len(allintersections)):
                 if allintersections[obstacle]:
                     print(f'all intersections with obstacle {obstacle} (route segment, obstacle segment): ', allintersections[obstacle])
-        # if there are intersections (if len is the same as if len > 0), define branching obstacle as first encountered
-        if len([_f for _f in allintersections if _f]):
-            # find index of obstacle in obsDic that will be encountered first
-            firstseg = []
-            for obst in range(len(allintersections)):
-                rseg = []
-                if allintersections[obst]:  
-                    for i in range(len(allintersections[obst])):
-                        # append the route segment index to rseg list
-                        rseg.append(allintersections[obst][i][0])
-                        if debugging_printing_flag:
-                            print(f'rseg', rseg)
-                    # append the minimum  to firstseg list
-                    firstseg.append(min(rseg))
-                else:
-                    # firstseg.append('NaN')
-                    firstseg.append(np.nan)
-            # find index of minimum route segment in firstseg list
-            if debugging_printing_flag:
-                print(f'firstseg', firstseg)
+        # in a single pass, find the first route segment that intersects any obstacle
+        # (firstseg) and the indices of all obstacles intersecting that route segment
+        firstseg = math.inf
+        indices = []
+        for obst, intersections in enumerate(allintersections):
+            if intersections:
+                # first route segment intersecting this obstacle
+                rseg = min(seg for seg, _ in intersections)
+                if rseg < firstseg:
+                    firstseg = rseg
+                    indices = [obst]
+                elif rseg == firstseg:
+                    indices.append(obst)
+        if debugging_printing_flag:
+            print(f'firstseg', firstseg, 'obstacles', indices)
 
-            # if the minimum value is in the list multiple times, calculate
+        # if there are intersections, define branching obstacle as first encountered
+        if indices:
+            # if multiple obstacles intersect the first route segment, calculate
             # intersection pts of each obstacle within that route segment and
             # select obstacle with least distance between route segment start and
             # point of intersection with obstacle
-            valid_firstseg = [f for f in firstseg if isinstance(f, int)]
-            if firstseg.count(min(valid_firstseg)) > 1:
-                indices = [i for i, x in enumerate(firstseg) if x == min(valid_firstseg)]
-                distlist = []
-                options = []
-                refpt = Pos(parent.waypoints[min(valid_firstseg)])
-                routpt1 = parent.waypoints[min(valid_firstseg)]
-                routpt2 = parent.waypoints[min(valid_firstseg)+1]
-                for i in range(len(indices)):
-                    for j in range(len(allintersections[indices[i]])):
-                        a = obsDic_xy[indices[i]].vert[allintersections[indices[i]][j][1]]
-                        b = obsDic_xy[indices[i]].vert[allintersections[indices[i]][j][1]+1]
-                        checkdist = intersectionpt(a,b,routpt1,routpt2) - refpt                  
-                        distlist.append((checkdist.length()))               
-                    options.append(min(distlist))
-                branch = indices[options.index(min(options))]
-
-            # else just take index of minimum route segment in firstseglist
+            if len(indices) > 1:
+                routpt1 = parent.waypoints[firstseg]
+                routpt2 = parent.waypoints[firstseg+1]
+                # stack the intersected obstacle segments of all candidate obstacles
+                owner = []
+                segstart = []
+                segend = []
+                for i in indices:
+                    for j in range(len(allintersections[i])):
+                        owner.append(i)
+                        segstart.append(obsDic_xy[i].vert[allintersections[i][j][1]])
+                        segend.append(obsDic_xy[i].vert[allintersections[i][j][1]+1])
+                a = np.array(segstart)
+                b = np.array(segend)
+                # distance between route segment start and all points of intersection at once
+                x,y,valid = intersectionpts(a[:,0],a[:,1],b[:,0],b[:,1],routpt1[0],routpt1[1],routpt2[0],routpt2[1])
+                checkdist = np.where(valid,np.sqrt((x-routpt1[0])**2+(y-routpt1[1])**2),np.inf)
+                branch = owner[int(np.argmin(checkdist))]
+
+            # else just take the only obstacle intersecting the first route segment
             else:
-                branch = firstseg.index(min(valid_firstseg))
+                branch = indices[0]
 
             # print which obstacle has been selected as branching obstacle
             if console_logging_flag:
@@ -389,20 +381,16 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
 
             # backward cleanup
             lstpt = altWptIndex+len(altWptLclean)                  # define the last waypoint index to consider (exit wypt from branching obstacle)
-            routeL.backwardcleanup(obsDic_xy,lstpt)
+            routeL.backwardcleanup(obsDic_xy,lstpt,blockmemo)
 
             if windsOn == 1:
                 windsaloftL = callWinds(wind,routeL) 
             else:
-                windsaloftL = [np.zeros(len(routeL.waypoints)),np.zeros(len(routeL.waypoints))]
+                windsaloftL = None                          # no wind, see Route.timecheck
 
             routeL.deviation = routeL.deviationcheck(parent,optimizationpriority,windsaloftL)
 
-            # should consider somehow adding the alt waypoints (and doing any other necessary changes, i.e. backward cleanup)
-            # and THEN declaring it's a route (and thus adding it to active waypoint list)
-            # need to do this as well for the routeR and directrt
-            # Route.active[-1] = routeL
-            Route.active.append(routeL)
+            heapq.heappush(Route.active, (routeL.deviation, next(counter), routeL))
 
             # plot left route in red        
     #        leftpltX,leftpltY = zip(*routeL.waypoints)
@@ -414,16 +402,15 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
 
             # backward cleanup
             lstpt = altWptIndex+len(altWptRclean)                  # define the last waypoint index to consider (exit wypt from branching obstacle)        
-            routeR.backwardcleanup(obsDic_xy,lstpt)
+            routeR.backwardcleanup(obsDic_xy,lstpt,blockmemo)
             
             if windsOn == 1:
                 windsaloftR = callWinds(wind,routeR)    
             else:
-                windsaloftR = [np.zeros(len(routeR.waypoints)),np.zeros(len(routeR.waypoints))]
+                windsaloftR = None                          # no wind, see Route.timecheck
             
             routeR.deviation = routeR.deviationcheck(parent,optimizationpriority,windsaloftR)
-            # Route.active[-1] = routeR
-            Route.active.append(routeR)
+            heapq.heappush(Route.active, (routeR.deviation, next(counter), routeR))
             
             # plot right route in green        
     #        rightpltX,rightpltY = zip(*routeR.waypoints)
@@ -450,25 +437,17 @@ def det_path_planning(lat0, lon0, altitude, TAS, latdest, londest, inputObs):
                     print('* first incumbent')
                     print('')
                 incflag = 1
-            elif optimizationpriority == 0:
-                if parent.distance < incumbent.distance:
-                    incumbent = parent
-                    if console_logging_flag:
-                        print('--> incumbent updated')
-                        print('')
-            elif optimizationpriority == 1:
-                if parent.time < incumbent.time:
-                    incumbent = parent
-                    if console_logging_flag:
-                        print('--> incumbent updated')
-                        print('')
+            elif routecost(parent) < routecost(incumbent):
+                incumbent = parent
+                if console_logging_flag:
+                    print('--> incumbent updated')
+                    print('')
 
     if console_logging_flag:
         print('############## end algorithm ##############')
         print('')
 
-    IncX,IncY = list(zip(*incumbent.waypoints))
-    
+    IncX,IncY = incumbent.xs,incumbent.ys
 
     if pltfinalsol:
         plt.plot(IncX,IncY,'-')  
@@ -7,10 +7,8 @@ Created on Tue Jun 14 11:39:20 2016
 Adapted from: Daphne Rein-Weston
 """
 from math import sqrt,atan2,acos,pi, isnan
+from functools import lru_cache
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.path import Path
-import matplotlib.patches as patches
 from bluesky_gym.envs.common.wind_field_deterministic_path_planning import Windfield
 
 debugging_printing_flag = 0
@@ -49,6 +47,24 @@ def XY2LatLon(x, y):
     lat = y/60.                                     # 60 nautical miles per degree latitude
     lon = x/(60.*np.cos(abs(np.radians(lat))))      # 60 nautical miles per degree longitude at equator, converging toward poles                             
     return (lat,lon)
+
+@lru_cache(maxsize=16)
+def defineobstacles(polygons):
+    # polygons is a tuple of obstacles, each a tuple of (lat,lon) vertices
+    # returns tuple of Obs instances in x,y and (N,4) array of their bounding boxes
+    # note: the returned obstacles are shared between calls, do not modify them
+    obstacles = ()
+    if len(polygons):
+        # convert the vertices of all obstacles in one call, offsets mark
+        # where the vertices of the next polygon start
+        latlon = np.array([vertex for polygon in polygons for vertex in polygon], dtype=np.float64)
+        offsets = np.cumsum([len(polygon) for polygon in polygons])
+        x, y = LatLon2XY(latlon[:,0], latlon[:,1])
+        obstacles = tuple(Obs(vertices) for vertices in np.split(np.column_stack((x, y)), offsets[:-1]))
+    bboxes = np.array([obstacle.bbox for obstacle in obstacles]).reshape(-1,4)
+    bboxes.flags.writeable = False
+    return obstacles, bboxes
+
 def ktsconvert(lst1, lst2):
     for i in range(len(lst1)):
         lst1[i] = lst1[i] * 1.94384                 # 1 m/s = 1.94384 kts
@@ -82,51 +98,81 @@ class Pos:
 #
 class Obs:
     def __init__(self,vertices):
-        self.vert = vertices
+        # vertices stored as (V,2) float64 array, with xs and ys as column views
+        self.vert = np.array(vertices, dtype=np.float64).reshape(-1,2)
         
         # Ensure obstacle is closed by checking if first and last vertices are equal
-        if self.vert[0] != self.vert[-1]:
-            self.vert.append(self.vert[0])
+        if not np.array_equal(self.vert[0], self.vert[-1]):
+            self.vert = np.vstack((self.vert, self.vert[0]))
 
         #! need to break apart any non-convex polygons here!        
         
         # if obstacle vertices are not in clockwise order, make them so
         if not self.direction():
-            self.vert.reverse()
+            self.vert = self.vert[::-1].copy()
+        self.xs = self.vert[:,0]
+        self.ys = self.vert[:,1]
+        # axis-aligned bounding box (xmin,xmax,ymin,ymax)
+        self.bbox = (self.xs.min(),self.xs.max(),self.ys.min(),self.ys.max())
+
+        # vertices as list of (x,y) tuples for index and membership lookups
+        self.vertlist = [tuple(v) for v in self.vert.tolist()]
         return
     def direction(self):
-        directioncheck = 0        
-        for i in range(len(self.vert)-1):
-            directioncheck = directioncheck + (self.vert[i+1][0]-self.vert[i][0])*(self.vert[i+1][1]+self.vert[i][1])
+        dx = self.vert[1:,0]-self.vert[:-1,0]
+        sy = self.vert[1:,1]+self.vert[:-1,1]
+        directioncheck = np.sum(dx*sy)
         if directioncheck > 0:
             clockwise = True
         else:
             clockwise = False
         return clockwise
     def intersectroute(self,routedef):
-        intersectiontab = []
-        (xwpts,ywpts) = list(zip(*routedef.waypoints))
-
-        for i in range(len(routedef.waypoints)-1):                     # iterate through all route segments
-            a = Pos((xwpts[i],ywpts[i]))
-            b = Pos((xwpts[i+1],ywpts[i+1]))
-            for j in range(len(self.vert)-1):                         # iterate through obstacle segments
-                c = Pos((self.vert[j][0],self.vert[j][1]))
-                d = Pos((self.vert[j+1][0],self.vert[j+1][1]))  
-                if notcolinear(a,b,c,d) and intersect(a,b,c,d):                  
-                    intersectiontab.append([i,j])                     # i corresponds to route segment and j corresponds to obstacle segment
-
+        # only route segments with a bounding box overlapping the obstacle can intersect it
+        xmin,xmax,ymin,ymax = self.bbox
+        segbbox = routedef.segbbox
+        segs = np.flatnonzero((segbbox[:,0] <= xmax) & (segbbox[:,1] >= xmin) & \
+                              (segbbox[:,2] <= ymax) & (segbbox[:,3] >= ymin))
+        if not len(segs):
+            return []
+
+        # test remaining route segments against all obstacle segments at once,
+        # hits[k,j] is True if route segment segs[k] intersects obstacle segment j
+        ax = routedef.xs[segs,None]
+        ay = routedef.ys[segs,None]
+        bx = routedef.xs[segs+1,None]
+        by = routedef.ys[segs+1,None]
+        hits = segintersect(ax,ay,bx,by,self.xs[:-1],self.ys[:-1],self.xs[1:],self.ys[1:])
+
+        # i corresponds to route segment and j corresponds to obstacle segment
+        k,j = np.nonzero(hits)
+        intersectiontab = np.column_stack((segs[k],j)).tolist()
         return intersectiontab
 
+    def blocks(self,a,b):
+        # A shortcut from a to b is blocked when it intersects an obstacle edge
+        # (and the two segments are not just colinear lying on top of each other),
+        # or when its midpoint lies inside the obstacle.
+        hits = segintersect(a.x,a.y,b.x,b.y,self.xs[:-1],self.ys[:-1],self.xs[1:],self.ys[1:])
+        if hits.any():
+            return True
+        midptx = float(a.x) + (float(b.x)-float(a.x))/2
+        midpty = float(a.y) + (float(b.y)-float(a.y))/2
+        # if the midpoint between two waypoints in the trajectory is on a 
+        # vertex of the obstacle, the waypoint in the middle can be removed 
+        # and we can skip the isInside check
+        if (midptx,midpty) in self.vertlist:
+            return False
+        return isInside(Pos((midptx,midpty)),self)
+
     def resort(self,segList,parent,intersectTab):
         # vertices of first segment in obstacle segment list:
         ver1 = self.vert[segList[0]]
         ver2 = self.vert[segList[0]+1]
 
         # vertices of route segment:
-        xwpts,ywpts = list(zip(*parent.waypoints))
-        rou1 = (xwpts[intersectTab[0][0]],ywpts[intersectTab[0][0]])
-        rou2 = (xwpts[intersectTab[0][0]+1],ywpts[intersectTab[0][0]+1])
+        rou1 = parent.waypoints[intersectTab[0][0]]
+        rou2 = parent.waypoints[intersectTab[0][0]+1]
         # vertices of last segment in obstacle segment list:        
         ver3 = self.vert[segList[-1]]
         ver4 = self.vert[segList[-1]+1]
@@ -148,12 +194,12 @@ class Obs:
         for i in range(len(segList)):
             # make exception for last alternative waypoint to prevent "over-rotation" around obstacle
             if i > 0 and  i == len(segList)-1:
-                if self.vert[segList[i]] not in altWptL:
-                    altWptL.append(self.vert[segList[i]])
+                if self.vertlist[segList[i]] not in altWptL:
+                    altWptL.append(self.vertlist[segList[i]])
             else:
-                if self.vert[segList[i]+1] not in altWptL:                
+                if self.vertlist[segList[i]+1] not in altWptL:                
                 # append the larger of the two vertices to the list of left alternative waypoints
-                    altWptL.append(self.vert[segList[i]+1])
+                    altWptL.append(self.vertlist[segList[i]+1])
         # (D) add additional obstacle vertices to list of left alternative waypoints, if necessary
         # create empty lists:
         indexLobs = []                                     # indices of obstacle vertices in altWptL
@@ -161,7 +207,7 @@ class Obs:
         # check for obstacle vertices in between consecutive altWptL entries
         for i in range(len(altWptL)):
             # populate list of indices of obstacle vertices in altWptL
-            indexLobs.append(self.vert.index(altWptL[i]))
+            indexLobs.append(self.vertlist.index(altWptL[i]))
             # check if indices are consecutive; if not, need to evaluate further
             if len(indexLobs)>=2 and abs(indexLobs[-1]-indexLobs[-2])%(len(self.vert)-1)>=2:
             # note: total number of obstacle vertices is len(obs)-1 because last vertex is same as first
@@ -176,10 +222,10 @@ class Obs:
                     a = Pos((altWptL[i-1][0],altWptL[i-1][1]))
                     c = Pos((altWptL[i][0],altWptL[i][1]))
                     # define b as "in-between" vertex position, taking into account possible indexing exceptions
-                    if self.vert.index(altWptL[i-1])==len(self.vert)-1:
+                    if self.vertlist.index(altWptL[i-1])==len(self.vert)-1:
                         bInd = 0
                     else:
-                        bInd = self.vert.index(altWptL[i-1])
+                        bInd = self.vertlist.index(altWptL[i-1])
                     if (bInd+j)>len(self.vert)-1:
                         bArg = (bInd+j)%(len(self.vert)-1)-1
                     else:
@@ -188,7 +234,7 @@ class Obs:
                     # check direction of a,b,c sequence
                     # append "in-between" vertex b to addL if direction is clockwise (i.e. not counterclockwise)
                     if not ccw(a,b,c):
-                        addL.append(self.vert[bArg])        
+                        addL.append(self.vertlist[bArg])        
     ##                    print 'added waypoint'
     ##                else:
     ##                    print 'no point added to altWptL'
@@ -210,15 +256,10 @@ class Obs:
             a = Pos((alt[-(i+1)-1][0],alt[-(i+1)-1][1]))
             b = destination
           #  b = Pos((destination[0],destination[1]))
-            intersection = []
-            for j in range(len(self.vert)-1):
-                c = Pos((self.vert[j][0],self.vert[j][1]))
-                d = Pos((self.vert[j+1][0],self.vert[j+1][1]))
-                if intersect(a,b,c,d) and notcolinear(a,b,c,d):
-                    intersection.append(j)
-                if (a.x, a.y) in self.vert:
-                    intersection.append(j)
-            if not len(intersection):
+            # obstacle segments intersecting the line from a to destination
+            hits = segintersect(a.x,a.y,b.x,b.y,self.xs[:-1],self.ys[:-1],self.xs[1:],self.ys[1:])
+            blocked = hits.any() or (a.x, a.y) in self.vertlist
+            if not blocked:
 #                midptx = float(a.x) + (float(b.x)-float(a.x))/2
 #                midpty = float(a.y) + (float(b.y)-float(a.y))/2
 #                midpt = Pos((midptx,midpty))
@@ -240,12 +281,12 @@ class Obs:
         for i in range(len(segList)):
                 # make exception for last alternative waypoint to prevent "over-rotation" around obstacle
             if i > 0 and  i == len(segList)-1:
-                if self.vert[segList[i]+1] not in altWptR:
-                    altWptR.append(self.vert[segList[i]+1])
+                if self.vertlist[segList[i]+1] not in altWptR:
+                    altWptR.append(self.vertlist[segList[i]+1])
             else:
-                if self.vert[segList[i]] not in altWptR:
+                if self.vertlist[segList[i]] not in altWptR:
                 # append the smaller of the two vertices to the list of right alternative waypoints                   
-                    altWptR.append(self.vert[segList[i]])
+                    altWptR.append(self.vertlist[segList[i]])
         # (D) add additional obstacle vertices to list of right alternative waypoints, if necessary
         # create empty lists:
         indexRobs = []                                         # indices of obstacle vertices in altWptR
@@ -253,7 +294,7 @@ class Obs:
         # check for obstacle vertices in between consecutive altWptR entries
         for i in range(len(altWptR)):
             # populate list of indices of obstacle vertices in altWptR
-            indexRobs.append(self.vert.index(altWptR[i]))
+            indexRobs.append(self.vertlist.index(altWptR[i]))
             # check if indices are consecutive; if not, need to evaluate further
             if len(indexRobs)>=2 and abs(indexRobs[-1]-indexRobs[-2])%(len(self.vert)-1)>=2:
             # note: total number of obstacle vertices is len(obs)-1 because last vertex is same as first
@@ -268,10 +309,10 @@ class Obs:
                     a = Pos((altWptR[i-1][0],altWptR[i-1][1]))
                     c = Pos((altWptR[i][0],altWptR[i][1]))
                     # define b as "in-between" vertex position, taking into account possible indexing exceptions
-                    if self.vert.index(altWptR[i-1])==0:
+                    if self.vertlist.index(altWptR[i-1])==0:
                         bInd = len(self.vert)-1
                     else:
-                        bInd = self.vert.index(altWptR[i-1])
+                        bInd = self.vertlist.index(altWptR[i-1])
                     if (bInd-j)<0:
                         bArg = len(self.vert)-1+(bInd-j)
                     else:
@@ -280,7 +321,7 @@ class Obs:
                     # check direction of a,b,c sequence
                     # append "in-between" vertex b to addR if direction is counterclockwise
                     if ccw(a,b,c):
-                        addR.append(self.vert[bArg])
+                        addR.append(self.vertlist[bArg])
     ##                    print 'added waypoint'
     ##                else:
     ##                    print 'no point added to altWptR'
@@ -295,6 +336,10 @@ class Obs:
     
     
     def plotter(self,fig,number, sector_color, plt_vertices_labels=0):
+        # matplotlib is only imported when plotting, importing it is slow
+        from matplotlib.path import Path
+        import matplotlib.patches as patches
+
         #create code sequence to draw obstacles (with flexible number of vertices)
         codes = []
         codes.append(Path.MOVETO)
@@ -346,7 +391,7 @@ class Obs:
         labels = string.ascii_uppercase  # 'A', 'B', 'C', ...
         vertex_labels = {}
 
-        for i, v in enumerate(self.vert):
+        for i, v in enumerate(self.vertlist):
             label = labels[i-1] 
             vertex_labels[label] = (v[0], v[1])
         
@@ -358,49 +403,67 @@ class Obs:
 
 class Route:
 #    allroutes = []
-    active = []
+    active = []                                         # heap of routes still to be evaluated, see det_path_planning
     def __init__(self,start,end,speed,wyptcoords,distrt,time,deviation):
      #   self.distance = distance
      #   self.heading = heading
         self.start = start
         self.end = end
         self.speed = speed
-        self.waypoints = wyptcoords
+        # waypoints stored as (N,2) float64 array, see xs and ys for the coordinate columns
+        self.waypoints = np.asarray(wyptcoords, dtype=np.float64).reshape(-1,2)
+        self._bbox = None
+        self._segbbox = None
         self.distance = distrt
         self.speed = speed
         self.deviation = deviation
         self.time = time
 #        self.numwpts = len(self.waypoints)
 #        Route.allroutes.append(self)
-        Route.active.append(self)
         return
+    @property
+    def xs(self):
+        return self.waypoints[:,0]
+    @property
+    def ys(self):
+        return self.waypoints[:,1]
+    @property
+    def bbox(self):
+        # axis-aligned bounding box (xmin,xmax,ymin,ymax) of the whole route
+        if self._bbox is None:
+            self._bbox = (self.xs.min(),self.xs.max(),self.ys.min(),self.ys.max())
+        return self._bbox
+    @property
+    def segbbox(self):
+        # (S,4) array with bounding box (xmin,xmax,ymin,ymax) of each route segment
+        if self._segbbox is None:
+            xs,ys = self.xs,self.ys
+            self._segbbox = np.column_stack((np.minimum(xs[:-1],xs[1:]),np.maximum(xs[:-1],xs[1:]),
+                                             np.minimum(ys[:-1],ys[1:]),np.maximum(ys[:-1],ys[1:])))
+        return self._segbbox
     def distancecheck(self):
-        runningtotal = []        
-        for i in range(len(self.waypoints)-1):
-            pt1 = Pos((self.waypoints[i]))            
-            pt2 = Pos((self.waypoints[i+1]))
-            segment = pt2 - pt1
-            runningtotal.append(segment.length())
-        return sum(runningtotal)
+        segx = np.diff(self.xs)
+        segy = np.diff(self.ys)
+        return np.sum(np.sqrt(segx*segx+segy*segy))
     def timecheck(self,winddata):
-        runningtotal = []        
-        for i in range(len(self.waypoints)-1):
-            pt1 = Pos((self.waypoints[i]))
-            wind1N = winddata[0][i]
-            wind1E = winddata[1][i]
-            pt2 = Pos((self.waypoints[i+1]))
-            wind2N = winddata[0][i+1]
-            wind2E = winddata[1][i+1]
-            segment = pt2 - pt1
-            avgwindN = np.mean([wind1N,wind2N])
-            avgwindE = np.mean([wind1E,wind2E])
-            heading = atan2(segment.y,segment.x)
-            Nspeed = (self.speed * np.sin(heading)) + avgwindN
-            Espeed = (self.speed * np.cos(heading)) + avgwindE
-            # given heading, how does north/east wind affect speed?
-            segspeed = sqrt(Nspeed*Nspeed + Espeed*Espeed)          
-            runningtotal.append(segment.length()/segspeed)
-        return sum(runningtotal)
+        segx = np.diff(self.xs)
+        segy = np.diff(self.ys)
+        if winddata is None:
+            # no wind data, so no wind correction
+            avgwindN = 0.
+            avgwindE = 0.
+        else:
+            windN = np.asarray(winddata[0], dtype=np.float64)
+            windE = np.asarray(winddata[1], dtype=np.float64)
+            # average wind over each segment
+            avgwindN = (windN[:-1]+windN[1:])/2
+            avgwindE = (windE[:-1]+windE[1:])/2
+        heading = np.arctan2(segy,segx)
+        Nspeed = (self.speed * np.sin(heading)) + avgwindN
+        Espeed = (self.speed * np.cos(heading)) + avgwindE
+        # given heading, how does north/east wind affect speed?
+        segspeed = np.sqrt(Nspeed*Nspeed + Espeed*Espeed)
+        return np.sum(np.sqrt(segx*segx+segy*segy)/segspeed)
     def deviationcheck(self,parentrt,optimizationpriority,winds):
         self.distance = self.distancecheck()
         self.time = self.timecheck(winds)
@@ -414,19 +477,18 @@ class Route:
             return owntime - parenttime
     def rem(self,wpt2remove):
         #self.waypoints.remove(self.waypoints[wpt2remove]) #had this!
-        del self.waypoints[wpt2remove]
+        self.waypoints = np.delete(self.waypoints, wpt2remove, axis=0)
+        self._bbox = None
+        self._segbbox = None
 #        self.numwpts = len(self.waypoints)
         self.start = self.waypoints[0]
         self.end = self.waypoints[-1]
         return
     def insert(self,index,wpt2add):
-        x,y = list(zip(*self.waypoints))
-        xroute = list(x)
-        yroute = list(y)
-        for i in range(len(wpt2add)):
-            xroute.insert(index+i,wpt2add[i][0])
-            yroute.insert(index+i,wpt2add[i][1])
-        self.waypoints = list(zip(xroute,yroute))
+        newpts = np.asarray(wpt2add, dtype=np.float64).reshape(-1,2)
+        self.waypoints = np.concatenate((self.waypoints[:index], newpts, self.waypoints[index:]))
+        self._bbox = None
+        self._segbbox = None
 #        self.numwpts = len(self.waypoints)
         self.start = self.waypoints[0]
         self.end = self.waypoints[-1]
@@ -445,7 +507,11 @@ class Route:
 #            self.numwpts = self.numwpts - 1
         return
 
-    def backwardcleanup(self,obstacles,lstptindex):
+    def backwardcleanup(self,obstacles,lstptindex,blockmemo):
+        # blockmemo maps (obstacle index,a.x,a.y,b.x,b.y) to the result of
+        # obstacle.blocks(a,b). Child routes keep most of their parent's waypoints,
+        # so the same shortcuts are checked over and over; pass the same dict
+        # for all routes of a planning call.
         # if no obstacle in the way, go direct!
 #        toconsider = self.waypoints[0:lstpt+1]        
 #        (xwpts,ywpts) = zip(*toconsider)
@@ -456,44 +522,25 @@ class Route:
             i = 0
             removed = 0
             while i < loopduration:
-                (xwpts,ywpts) = list(zip(*self.waypoints[0:loopduration+2]))
                 intersectiontab = []
-                a = Pos((xwpts[i],ywpts[i]))
-                b = Pos((xwpts[i+2],ywpts[i+2]))
+                a = Pos(self.waypoints[i])
+                b = Pos(self.waypoints[i+2])
+                segbbox = (min(a.x,b.x),max(a.x,b.x),min(a.y,b.y),max(a.y,b.y))
                 for index in range(len(obstacles)):            
-                    for j in range(len(obstacles[index].vert)-1):                         # iterate through obstacle segments
-                        c = Pos((obstacles[index].vert[j][0],obstacles[index].vert[j][1]))
-                        d = Pos((obstacles[index].vert[j+1][0],obstacles[index].vert[j+1][1]))  
-                        # If the straight line between waypoints i (a) and i+2 (b) intersects 
-                        # the obstacle edge (c,d), and the two segments are not just colinear 
-                        # lying on top of each other, then the middle waypoint i+1 cannot be 
-                        # removed, as it is needed to go around the obstacle. So we add it to the list of intersections.
-                        if notcolinear(a,b,c,d) and intersect(a,b,c,d):
-                            intersectiontab.append(j) # i corresponds to route segment and j corresponds to obstacle segment
-
-                    if not len(intersectiontab):
-#                        rndobs = []
-#                        for i in range(len(obstacles[index].vert)):
-#                            rnded = Pos(obstacles[index].vert[i]).rounded()
-#                            rndobs.append(rnded)
-#                            print rndobs
-#                        if (a.rounded() in rndobs) and (b.rounded() in rndobs):   
-#                            print 'got in!'
-                        midptx = float(a.x) + (float(b.x)-float(a.x))/2
-                        midpty = float(a.y) + (float(b.y)-float(a.y))/2
-                        midpt = Pos((midptx,midpty))
-                        skip_check_inside = 0
-                        for l in range(len(obstacles[index].vert)-1):
-                            vectorA = midpt-Pos(obstacles[index].vert[l])
-                            vectorB = midpt-Pos(obstacles[index].vert[l+1])
-                            # if either vector has length 0, the midpoint between two waypoints 
-                            # in the trajectory is on a vertex of the obstacle. Therefore the 
-                            # waypoint in the middle can be removed and we can skip the isInside check
-                            if vectorA.length() == 0 or vectorB.length() == 0:
-                                skip_check_inside = 1
-                        if not skip_check_inside:
-                            if isInside(midpt,obstacles[index]):
-                                intersectiontab.append(index)
+                    obs = obstacles[index]
+                    # nothing to check if the line from a to b stays outside the obstacle bounding box
+                    if not bboxoverlap(segbbox,obs.bbox):
+                        continue
+                    # If the straight line between waypoints i (a) and i+2 (b) is 
+                    # blocked by an obstacle, then the middle waypoint i+1 cannot be 
+                    # removed, as it is needed to go around the obstacle.
+                    key = (index,a.x,a.y,b.x,b.y)
+                    blocked = blockmemo.get(key)
+                    if blocked is None:
+                        blocked = blockmemo[key] = obs.blocks(a,b)
+                    if blocked:
+                        intersectiontab.append(index)
+                        break
                 if not len(intersectiontab):
                     self.rem(i+1)
                     removed = 1
@@ -534,16 +581,8 @@ def parse(start,end):            # start and end inputs are from Pos class
     return totalDist, heading, list(zip(xwpts,ywpts))
     
 def callWinds(wind,route,altitude=0):
-    # Call wind, with list for lat,lon and altitude:
-    X,Y = list(zip(*route.waypoints))
-    X = list(X)
-    Y = list(Y)
-    Lats = []
-    Lons = []
-    for i in range(len(X)):
-        lat,lon = XY2LatLon(X[i],Y[i])
-        Lats.append(lat)
-        Lons.append(lon) 
+    # Call wind, with arrays for lat,lon and altitude:
+    Lats,Lons = XY2LatLon(route.xs,route.ys)
     # Using vector for position but all on same altitude
     if altitude == 0:
         vn,ve = wind.getdata(Lats,Lons)
@@ -563,8 +602,8 @@ def detSign(vector1,vector2):
 def isInside(position,obstacle):
     angle = []
     for i in range(len(obstacle.vert)-1):
-        vectorA = position-Pos(obstacle.vert[i])
-        vectorB = position-Pos(obstacle.vert[i+1])
+        vectorA = position-Pos(obstacle.vertlist[i])
+        vectorB = position-Pos(obstacle.vertlist[i+1])
 
         # Equation (2) of Hormann 2001 Computational Geometry publication
         # computationally expensive version of calculating winding number
@@ -589,30 +628,52 @@ def isInside(position,obstacle):
  
 def ccw(A,B,C):
     return (C.y-A.y)*(B.x-A.x) >= (B.y-A.y)*(C.x-A.x)
-def intersect(A,B,C,D):
-    return ccw(A,C,D) != ccw(B,C,D) and ccw(A,B,C) != ccw(A,B,D)
-    
-def notcolinear(A,B,C,D):
-    if (C.y-B.y)*(A.x-B.x) - (A.y-B.y)*(C.x-B.x) == 0:
-        return False
-    elif (D.y-A.y)*(B.x-A.x) - (B.y-A.y)*(D.x-A.x) == 0:
-        return False
-    else:
-        return True
-    
-  #  return bool(round((C.y-A.y)*(B.x-A.x) - (B.y-A.y)*(C.x-A.x))) and bool(round((D.y-A.y)*(B.x-A.x) - (B.y-A.y)*(D.x-A.x)))
 
-# use point-slope form of line equation to find intersection point
+def bboxoverlap(bbox1,bbox2):
+    # bounding boxes given as (xmin,xmax,ymin,ymax), touching boxes overlap
+    return bbox1[0] <= bbox2[1] and bbox1[1] >= bbox2[0] and \
+           bbox1[2] <= bbox2[3] and bbox1[3] >= bbox2[2]
+
+def bboxquery(bbox,bboxes):
+    # indices of the (N,4) array of bounding boxes overlapping bbox
+    overlap = (bboxes[:,0] <= bbox[1]) & (bboxes[:,1] >= bbox[0]) & \
+              (bboxes[:,2] <= bbox[3]) & (bboxes[:,3] >= bbox[2])
+    return np.flatnonzero(overlap).tolist()
+
+def segintersect(ax,ay,bx,by,cx,cy,dx,dy):
+    # True where segment AB properly crosses segment CD and the two are not
+    # colinear, inputs are arrays of segment end point coordinates (broadcast)
+    # ccwarr is ccw(P,Q,R) above, written out on coordinates
+    def ccwarr(px,py,qx,qy,rx,ry):
+        return (ry-py)*(qx-px) >= (qy-py)*(rx-px)
+    crossing = (ccwarr(ax,ay,cx,cy,dx,dy) != ccwarr(bx,by,cx,cy,dx,dy)) & \
+               (ccwarr(ax,ay,bx,by,cx,cy) != ccwarr(ax,ay,bx,by,dx,dy))
+    noncolinear = ((cy-by)*(ax-bx) - (ay-by)*(cx-bx) != 0) & \
+                  ((dy-ay)*(bx-ax) - (by-ay)*(dx-ax) != 0)
+    return crossing & noncolinear
+
+# use parametric form a + t*(b-a) of line equation to find intersection points
+# of the lines through segments ab and cd, inputs are coordinates or arrays of
+# coordinates (broadcast), valid is False where the lines are parallel
+def intersectionpts(ax,ay,bx,by,cx,cy,dx,dy):
+    rx = bx-ax
+    ry = by-ay
+    sx = dx-cx
+    sy = dy-cy
+    rxs = rx*sy - ry*sx
+    valid = rxs != 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = ((cx-ax)*sy - (cy-ay)*sx)/rxs
+    return ax+t*rx, ay+t*ry, valid
+
 # (only for use on line segments that we already know will intersect)
 def intersectionpt(a,b,c,d):
-    slope1 = (a[1]-b[1])/(a[0]-b[0])
-    slope2 = (c[1]-d[1])/(c[0]-d[0])
-    x = (slope1*a[0] - slope2*c[0] + c[1] - a[1]) / (slope1 - slope2)
-    y = slope1*(x-a[0]) + a[1]
+    x,y,_ = intersectionpts(a[0],a[1],b[0],b[1],c[0],c[1],d[0],d[1])
     intpt = Pos((x,y))
     return intpt
     
 def wyptannotate(xwpts,ywpts):
+    import matplotlib.pyplot as plt
     for i in range(len(xwpts)):
         plt.scatter(xwpts[i],ywpts[i])
         wptname = 'wpt' + str(i)
@@ -1,3 +1,4 @@
+import math
 import numpy as np
 import pygame
 
@@ -15,6 +16,11 @@ VZ_STD = 5
 RWY_DIS_MEAN = 100
 RWY_DIS_STD = 200
 
+DEFAULT_RWY_DIS = 200
+RWY_LAT = 52
+RWY_LON = 4
+RE_KM = 6371. # earth radius used by bs.tools.geo.kwikdist, in km
+
 ACTION_2_MS = 12.5
 
 ALT_DIF_REWARD_SCALE = -5/3000
@@ -87,32 +93,45 @@ class DescentEnv(gym.Env):
         self.clock = None
 
 
+    def _update_render_state(self):
+        """
+        Update altitude, vertical speed and runway distance from the simulation,
+        these are used by _render_frame and _get_obs
+        """
+        traf = bs.traf
+
+        self.altitude = traf.alt[0]
+        self.vz = traf.vs[0]
+
+        # runway distance in km, same flat earth approximation as bs.tools.geo.kwikdist
+        # but specialized for the fixed runway position
+        lat = traf.lat[0]
+        dlat = math.radians(lat - RWY_LAT)
+        dlon = math.radians(((traf.lon[0] - RWY_LON)+180)%360-180)
+        cavelat = math.cos(math.radians(lat + RWY_LAT)*0.5)
+        self.runway_distance = DEFAULT_RWY_DIS - RE_KM*math.sqrt(dlat*dlat + dlon*dlon*cavelat*cavelat)
+
     def _get_obs(self):
         """
         Observation consists of altitude, vertical speed, target altitude and distance to runway
         Very crude normalization in place for now
         """
+        self._update_render_state()
 
-        DEFAULT_RWY_DIS = 200 
-        RWY_LAT = 52
-        RWY_LON = 4
-        NM2KM = 1.852
-
-        self.altitude = bs.traf.alt[0]
-        self.vz = bs.traf.vs[0]
-        self.runway_distance = (DEFAULT_RWY_DIS - bs.tools.geo.kwikdist(RWY_LAT,RWY_LON,bs.traf.lat[0],bs.traf.lon[0])*NM2KM)
-
-        # very crude normalization
-        obs_altitude = np.array([(self.altitude - ALT_MEAN)/ALT_STD])
-        obs_vz = np.array([(self.vz - VZ_MEAN) / VZ_STD])
-        obs_target_alt = np.array([((self.target_alt- ALT_MEAN)/ALT_STD)])
-        obs_runway_distance = np.array([(self.runway_distance - RWY_DIS_MEAN)/RWY_DIS_STD])
+        # very crude normalization, values are stored in a single new array
+        # and returned as views, so earlier observations are not overwritten
+        obs = np.array([
+            (self.altitude - ALT_MEAN)/ALT_STD,
+            (self.vz - VZ_MEAN) / VZ_STD,
+            self.obs_target_alt,
+            (self.runway_distance - RWY_DIS_MEAN)/RWY_DIS_STD
+        ])
 
         observation = {
-                "altitude": obs_altitude,
-                "vz": obs_vz,
-                "target_altitude": obs_target_alt,
-                "runway_distance": obs_runway_distance,
+                "altitude": obs[0:1],
+                "vz": obs[1:2],
+                "target_altitude": obs[2:3],
+                "runway_distance": obs[3:4],
             }
         
         return observation
@@ -128,21 +147,16 @@ class DescentEnv(gym.Env):
     
     def _get_reward(self):
 
-        # reward part of the function
-        if self.runway_distance > 0 and self.altitude > 0:
+        # reward part of the function, episode ends when crashing or reaching the runway
+        terminated = not (self.runway_distance > 0 and self.altitude > 0)
+        if not terminated:
             reward = abs(self.target_alt - self.altitude) * ALT_DIF_REWARD_SCALE
-            self.total_reward += reward
-            return reward, 0
-        elif self.altitude <= 0:
-            reward = CRASH_PENALTY
-            self.final_altitude = -100
-            self.total_reward += reward
-            return reward, 1
-        elif self.runway_distance <= 0:
-            reward = self.altitude * RWY_ALT_DIF_REWARD_SCALE
-            self.final_altitude = self.altitude
-            self.total_reward += reward
-            return reward, 1
+        else:
+            crashed = self.altitude <= 0
+            reward = CRASH_PENALTY if crashed else self.altitude * RWY_ALT_DIF_REWARD_SCALE
+            self.final_altitude = -100 if crashed else self.altitude
+        self.total_reward += reward
+        return reward, int(terminated)
         
     def _get_action(self,action):
         # Transform action to the meters per second
@@ -153,12 +167,9 @@ class DescentEnv(gym.Env):
         # altitude command
 
         # The actions are then executed through stack commands;
-        if action >= 0:
-            bs.traf.selalt[0] = 1000000 # High target altitude to start climb
-            bs.traf.selvs[0] = action
-        elif action < 0:
-            bs.traf.selalt[0] = 0 # High target altitude to start descent
-            bs.traf.selvs[0] = action
+        # high target altitude to start climb, low target altitude to start descent
+        bs.traf.selalt[0] = 1000000 if action >= 0 else 0
+        bs.traf.selvs[0] = action
 
     def reset(self, seed=None, options=None):
         
@@ -170,6 +181,8 @@ class DescentEnv(gym.Env):
 
         alt_init = np.random.randint(ALT_MIN, ALT_MAX)
         self.target_alt = alt_init + np.random.randint(-TARGET_ALT_DIF,TARGET_ALT_DIF)
+        # target altitude is constant during the episode, normalize it once
+        self.obs_target_alt = (self.target_alt - ALT_MEAN)/ALT_STD
 
         bs.traf.cre('KL001',actype="A320",acalt=alt_init,acspd=AC_SPD)
         bs.traf.swvnav[0] = False
@@ -191,7 +204,7 @@ class DescentEnv(gym.Env):
             bs.sim.step()
             if self.render_mode == "human":
                 self._render_frame()
-                observation = self._get_obs()
+                self._update_render_state()
 
         observation = self._get_obs()
         reward, terminated = self._get_reward()